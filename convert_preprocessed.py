@@ -0,0 +1,28 @@
+# Convert preprocessed directories to the binary formats.
+import argparse
+import json
+import os
+
+from utils.read_conllu import Data
+from utils.repr_store import ReprStore, npz_to_store
+
+if __name__ == "__main__":
+    # Set up argument parser.
+    parser = argparse.ArgumentParser("Convert preprocessed.json and npz representations to binary formats.")
+    parser.add_argument("--data_dir")
+    args = parser.parse_args()
+
+    for lang in os.listdir(args.data_dir):
+        path = os.path.join(args.data_dir, lang)
+        json_path = os.path.join(path, "preprocessed.json")
+        npz_path = os.path.join(path, "preprocessed.npz")
+        if os.path.exists(json_path) and not os.path.exists(npz_path):
+            print(f"Converting {json_path}")
+            with open(json_path, encoding="utf-8") as file:
+                split_dict = json.load(file)
+            Data.from_json(split_dict).to_npz(npz_path)
+        for f in os.listdir(path):
+            name, ext = os.path.splitext(f)
+            if ext == ".npz" and f != "preprocessed.npz" and not ReprStore.exists(path, name):
+                print(f"Converting {os.path.join(path, f)}")
+                npz_to_store(path, name)
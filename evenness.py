@@ -1,77 +1,71 @@
 # Calculate evennes in data set.
 import argparse
-from collections import Counter
-import json
-import math
+from concurrent.futures import ProcessPoolExecutor
 import os
 
 import pandas as pd
 
-from utils.read_conllu import Data
+from utils.corpus_stats import corpus_stats
+from utils.read_conllu import load_preprocessed
 
-def load_json(path):
-    with open(path, encoding="utf-8") as file:
-        split_dict = json.load(file)
-    return Data.from_json(split_dict)
+COLUMNS = ["Language", "Shannon Evenness Index", "#Labels", "Shannon Entropy", "Coverage"]
+
+def language_stats(data_dir, language, properties=None):
+    path = os.path.join(data_dir, language)
+    data = load_preprocessed(path)
+    train_sents = data.train()
+    if len(train_sents) == 0:
+        return language, dict()
+    # Statistics of all properties from one pass over the label index.
+    return language, corpus_stats(train_sents, properties)
+
+def out_file(out_dir, property, n_properties):
+    # A single property may still be written to a file path as before.
+    if n_properties == 1 and out_dir.endswith(".tsv"):
+        return out_dir
+    return os.path.join(out_dir, "evenness_{}.tsv".format(property.lower()))
 
 if __name__ == "__main__":
     # Set up argument parser.
     parser = argparse.ArgumentParser("")
     parser.add_argument("--data_dir")
     parser.add_argument("--out_dir")
-    parser.add_argument("--property")
+    parser.add_argument("--property", nargs="*", default=None)
+    parser.add_argument("--workers", type=int, default=1)
     args = parser.parse_args()
 
     data_dir = args.data_dir
-    property = args.property
+    properties = args.property or None
     out_dir = args.out_dir
 
-    langs = os.listdir(data_dir)
-    data_df = {"Language": [], "Shannon Evenness Index": [], "#Labels": []}
-    for language in langs:
-        print("Processing language {}".format(language))
-        path = os.path.join(data_dir, language)
-        data = load_json(os.path.join(path, "preprocessed.json"))
-        train_sents = data.train()
+    langs = sorted(os.listdir(data_dir))
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(
+            language_stats, [data_dir] * len(langs), langs, [properties] * len(langs)
+        ))
 
-        if len(train_sents) == 0:
+    if properties is None:
+        properties = sorted({prop for _, stats in results for prop in stats})
+    data_dfs = {prop: {col: [] for col in COLUMNS} for prop in properties}
+    for language, stats in results:
+        print("Processing language {}".format(language))
+        for property in properties:
+            prop_stats = stats.get(property)
+            # Skip languages with at most one label for this property.
+            if prop_stats is None or prop_stats["#Labels"] <= 1:
                 continue
-
-        label_counter = Counter()
-
-        for idx, sent in enumerate(train_sents):
-            for word in sent:
-                if property == "upos":
-                    label = word.upos
-                else:
-                    feats = word.feats
-                    label = feats.get(property)
-                if label is not None:
-                        label_counter[label] += 1
-        # Maximum Shannon Entropy
-        num_labels = len(label_counter.keys())
-        if num_labels <= 1:
-             continue
-        
-        max_entropy = math.log(num_labels)
-        # Actual Shannon Entropy
-        total_count = label_counter.total()
-        H = 0
-        for label, count in label_counter.items():
-                prop_label = count / total_count
-                information = prop_label * math.log(prop_label)
-                H += information
-        H = -1 * H
-        # Shannon Evennes Index
-        evenness_index = H / max_entropy
-
-        # Add results fo dictionary.
-        data_df["Language"].append(language)
-        data_df["#Labels"].append(num_labels)
-        data_df["Shannon Evenness Index"].append(evenness_index)
-        print("Evenness Index: ", round(evenness_index, ndigits=3)) 
-        print("Number of labels: ", num_labels)
+            # Add results fo dictionary.
+            data_dfs[property]["Language"].append(language)
+            for col in COLUMNS[1:]:
+                data_dfs[property][col].append(prop_stats[col])
+            print(property)
+            print("Evenness Index: ", round(prop_stats["Shannon Evenness Index"], ndigits=3))
+            print("Number of labels: ", prop_stats["#Labels"])
         print("===="*30)
-    
-    df = pd.DataFrame(data_df)
-    df.to_csv(out_dir, sep="\t")    
\ No newline at end of file
+
+    for property, data_df in data_dfs.items():
+        path = out_file(out_dir, property, len(properties))
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        df = pd.DataFrame(data_df)
+        df.to_csv(path, sep="\t")
@@ -2,24 +2,56 @@ import argparse
 import json
 import numpy as np
 import os
-from transformers import BertTokenizer, BertModel
+from transformers import BertTokenizerFast, BertModel
 from tqdm import tqdm
 
-from probe.probe import get_original_word_representations, convert_to_ids
+from probe.probe import get_batch_word_representations, convert_to_ids_batch
+from utils.batching import length_batches
+from utils.layers import parse_layers, repr_name
 from utils.read_conllu import Data
+from utils.repr_store import ReprStore
 
 
-def convert(sent_list, tokenizer, model):
-    json_repr = []
-    bert_repr = []
-    for sent in sent_list:
-        words = [w.form for w in sent]
-        json_repr.append(sent.to_json())
-        mapping, ids = convert_to_ids(words, tokenizer=tokenizer)
-        repr = get_original_word_representations(ids, model, mapping)
-        bert_repr.append(repr.detach().numpy())
+def convert(sent_list, tokenizer, model, batch_size=1, max_tokens=None, layers=None):
+    json_repr = [sent.to_json() for sent in sent_list]
+    word_lists = [[w.form for w in sent] for sent in sent_list]
+    converted = convert_to_ids_batch(word_lists, tokenizer=tokenizer)
+    mappings = [mapping for mapping, _ in converted]
+    ids_list = [ids for _, ids in converted]
+    # Group sentences of similar subword length and restore
+    # the original sentence order afterwards.
+    bert_repr = [None] * len(sent_list)
+    lengths = [ids.shape[-1] for ids in ids_list]
+    for batch in length_batches(lengths, max_tokens=max_tokens, batch_size=batch_size):
+        reprs = get_batch_word_representations(
+            [ids_list[idx] for idx in batch],
+            model,
+            [mappings[idx] for idx in batch],
+            pad_id=tokenizer.pad_token_id,
+            layers=layers
+        )
+        for idx, repr in zip(batch, reprs):
+            bert_repr[idx] = repr.detach().numpy()
     return json_repr, bert_repr
 
+def save_repr(out_path, split, bert_repr, layers=None, repr_format="mmap"):
+    if layers is None:
+        named_reprs = [(split, bert_repr)]
+    else:
+        # Representations have shape (#words, #layers, hidden), save one file per layer.
+        named_reprs = [
+            (repr_name(split, layer), [sent[:, layer_idx] for sent in bert_repr])
+            for layer_idx, layer in enumerate(layers)
+        ]
+    for name, reprs in named_reprs:
+        if repr_format == "mmap":
+            ReprStore.save(out_path, name, reprs)
+        else:
+            np.savez_compressed(
+                os.path.join(out_path, name),
+                **{str(idx): sent for idx, sent in enumerate(reprs)}
+            )
+
 if __name__ == "__main__":
     # Set up argument parser.
     parser = argparse.ArgumentParser("Convert and sample data.")
@@ -30,18 +62,32 @@ if __name__ == "__main__":
     parser.add_argument("--out_dir")
     parser.add_argument('--strict_sample',
                     action='store_true') 
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--max_tokens", type=int, default=8192)
+    parser.add_argument("--layers", help="Hidden layers to save, e.g. 'all', '8', '0-12' or '0,4,8'.")
+    parser.add_argument("--repr_format", choices=["mmap", "npz"], default="mmap")
+    parser.add_argument("--stream", action="store_true", help="Sample train sentences while reading with reservoir sampling, implies --strict_sample.")
     args = parser.parse_args()
+    if args.stream and args.sample_size is None:
+        parser.error("--stream needs --sample_size.")
 
     seed = args.seed
     sample_size = args.sample_size
     PRETRAINED_MODEL = args.pretrained #"google-bert/bert-base-multilingual-cased"
     data_dir = args.data_dir
     out_dir = args.out_dir
-    strict_sample = args.strict_sample
+    # Without strict sampling the whole training data is kept, which
+    # --stream is meant to avoid.
+    strict_sample = args.strict_sample or args.stream
+    batch_size = args.batch_size
+    max_tokens = args.max_tokens
+    repr_format = args.repr_format
 
     # Load pretrained model.
-    tokenizer = BertTokenizer.from_pretrained(PRETRAINED_MODEL)
+    tokenizer = BertTokenizerFast.from_pretrained(PRETRAINED_MODEL)
     model = BertModel.from_pretrained(PRETRAINED_MODEL)
+    # Hidden states include the embedding output, hence one more than the number of layers.
+    layers = parse_layers(args.layers, n_layers=model.config.num_hidden_layers + 1)
     
 
     # Start converting.
@@ -60,21 +106,22 @@ if __name__ == "__main__":
             train = data.train(
                 sample_size=sample_size,
                 seed=seed,
-                strict_sample=strict_sample
+                strict_sample=strict_sample,
+                stream=args.stream
             )
         except ValueError:
             print(f"Skipped {lang}, not enough samples in train.")
             continue
 
-        train_json, train_repr = convert(train, tokenizer=tokenizer, model=model)
+        train_json, train_repr = convert(train, tokenizer=tokenizer, model=model, batch_size=batch_size, max_tokens=max_tokens, layers=layers)
 
         # Convert test
         test = data.test()
-        test_json, test_repr = convert(test, tokenizer=tokenizer, model=model)    
+        test_json, test_repr = convert(test, tokenizer=tokenizer, model=model, batch_size=batch_size, max_tokens=max_tokens, layers=layers)    
 
         # Convert dev
         dev = data.dev()
-        dev_json, dev_repr = convert(dev, tokenizer=tokenizer, model=model)  
+        dev_json, dev_repr = convert(dev, tokenizer=tokenizer, model=model, batch_size=batch_size, max_tokens=max_tokens, layers=layers)  
 
         # Create output dir.
         out_path = os.path.join(out_dir, lang)
@@ -89,16 +136,9 @@ if __name__ == "__main__":
 
         with open(os.path.join(out_path, "preprocessed.json"), "w", encoding="utf-8") as json_f:
             json.dump(json_dict, json_f)
+        # Binary columnar copy, which loads without parsing.
+        Data.from_json(json_dict).to_npz(os.path.join(out_path, "preprocessed.npz"))
 
-        np.savez_compressed(
-            os.path.join(out_path, "test"),
-            **{str(idx): sent for idx, sent in enumerate(test_repr)}
-        )
-        np.savez_compressed(
-            os.path.join(out_path, "train"),
-            **{str(idx): sent for idx, sent in enumerate(train_repr)}
-        )
-        np.savez_compressed(
-            os.path.join(out_path, "dev"),
-            **{str(idx): sent for idx, sent in enumerate(dev_repr)}
-        )
+        save_repr(out_path, "test", test_repr, layers=layers, repr_format=repr_format)
+        save_repr(out_path, "train", train_repr, layers=layers, repr_format=repr_format)
+        save_repr(out_path, "dev", dev_repr, layers=layers, repr_format=repr_format)
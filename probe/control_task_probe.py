@@ -1,51 +1,41 @@
-import random
+import numpy as np
 
 from .probe_classifiers import ClassifierProbe
 
 class ControlTaskProbe(ClassifierProbe):
 
-    def __init__(self, data, train_repr, test_repr, clf_type, property="upos") -> None:
-        super().__init__(data, train_repr, test_repr, clf_type, property)
-        self.control_task_mapping = dict()
+    def __init__(self, data, train_repr, test_repr, clf_type, property="upos", extractor=None, chunk_size=None, epochs=5, seed=None) -> None:
+        super().__init__(data, train_repr, test_repr, clf_type, property, extractor, chunk_size, epochs)
+        # Without a seed, the mapping follows the global numpy random state.
+        if seed is None:
+            seed = np.random.randint(2**31 - 1)
+        self.rng = np.random.default_rng(seed)
+        # Control task class of every word form, indexed by form id.
+        self.control_task_mapping = np.empty(0, dtype=np.int64)
         self.n_classes = self.get_n_classes()
-    
-    def get_features_and_labels(self, split):
-        if split not in ("train", "test"):
-            raise ValueError(f"{split} must be either 'train' or 'test'.")
-        
-        # Decide for train or test split
-        if split == "train":
-            sents = self.data.train()
-            repr = self.train_repr
-        else:
-            sents = self.data.test()
-            repr = self.test_repr
-        features = []
-        labels = []
-        for idx, sent in enumerate(sents):
-            bert_repr = repr[str(idx)]
-            for i in range(bert_repr.shape[0]):
-                word = sent[i]
-                self.control_task_mapping.setdefault(
-                    word.form,
-                    random.randrange(self.n_classes)
-                )
-                control_task_label = self.control_task_mapping[word.form]
-                features.append(bert_repr[i])
-                labels.append(control_task_label)
-        return features, labels
+
+    def get_positions(self, split):
+        # Control task labels are assigned to all tokens, regardless of the property.
+        split_features = self.extractor.split(split)
+        return np.flatnonzero(split_features.mask())
+
+    def get_control_labels(self, form_ids):
+        # The mapping grows with the vocabulary, as forms of later splits are added.
+        n_forms = int(form_ids.max()) + 1 if len(form_ids) > 0 else 0
+        if n_forms > len(self.control_task_mapping):
+            new_labels = self.rng.integers(self.n_classes, size=n_forms - len(self.control_task_mapping))
+            self.control_task_mapping = np.concatenate([self.control_task_mapping, new_labels])
+        return self.control_task_mapping[form_ids]
+
+    def get_chunk(self, split, positions):
+        split_features = self.extractor.split(split)
+        features = split_features.features_at(positions)
+        return features, self.get_control_labels(split_features.form_ids[positions])
+
+    def get_train_classes(self, positions):
+        return np.arange(self.n_classes)
     
     def get_n_classes(self):
-        classes = set()
-        for sent in self.data.train():
-            for word in sent:
-                if self.property == "upos":
-                    ling_feat = word.upos
-                else:
-                    feats = word.feats
-                    if self.property not in feats:
-                        continue
-                    ling_feat = feats[self.property]
-                classes.add(ling_feat)
-        return len(classes)
-                
\ No newline at end of file
+        split_features = self.extractor.split("train")
+        codes = split_features.label_codes(self.property)
+        return len(np.unique(codes[codes >= 0]))
@@ -0,0 +1,126 @@
+import numpy as np
+
+from utils.read_conllu import Corpus
+from utils.repr_store import ReprStore
+
+
+def npz_shape(npz, key):
+    # Reads only the header at the start of the member.
+    with npz.zip.open(key + ".npy") as file:
+        version = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            shape, _, _ = np.lib.format.read_array_header_1_0(file)
+        else:
+            shape, _, _ = np.lib.format.read_array_header_2_0(file)
+    return shape
+
+
+class FeatureExtractor:
+    # Extracts tokens, word forms, labels and representations of a
+    # language once, so that all probes can share them.
+
+    def __init__(self, data, train_repr=None, test_repr=None, dev_repr=None) -> None:
+        self.data = data
+        self.train_repr = train_repr
+        self.test_repr = test_repr
+        self.dev_repr = dev_repr
+        self.vocabs = Corpus.new_vocabs() # Used if splits are not yet a Corpus
+        self._corpora = None
+        self._splits = dict()
+
+    def corpus(self, split):
+        # All splits are encoded into the shared vocabularies before any
+        # label index is built. Classes are taken from the vocabularies,
+        # so label codes only agree across splits if no split adds values
+        # after another one was indexed.
+        if self._corpora is None:
+            self._corpora = {
+                "train": Corpus.from_sentences(self.data.train(), vocabs=self.vocabs),
+                "test": Corpus.from_sentences(self.data.test(), vocabs=self.vocabs),
+                "dev": Corpus.from_sentences(self.data.dev(), vocabs=self.vocabs),
+            }
+        return self._corpora[split]
+
+    def split(self, split):
+        if split not in ("train", "test", "dev"):
+            raise ValueError(f"{split} must be one of 'train', 'test' or 'dev'.")
+        if split not in self._splits:
+            if split == "train":
+                repr = self.train_repr
+            elif split == "test":
+                repr = self.test_repr
+            else:
+                repr = self.dev_repr
+            self._splits[split] = SplitFeatures(self.corpus(split), repr)
+        return self._splits[split]
+
+
+class SplitFeatures:
+
+    def __init__(self, corpus, repr) -> None:
+        self.corpus = corpus
+        self.form_ids = corpus.form_ids
+        self._label_codes = dict()
+
+        sent_lengths = np.diff(corpus.offsets)
+        if repr is None:
+            n_repr = sent_lengths
+            self.features = None
+        else:
+            self.features, n_repr = self.read_features(repr, len(sent_lengths))
+        # Row of each token in the feature matrix, -1 if it was truncated.
+        sent_idx = np.repeat(np.arange(len(sent_lengths)), sent_lengths)
+        position = np.arange(len(sent_idx)) - corpus.offsets[sent_idx]
+        self.in_repr = position < n_repr[sent_idx]
+        self.rows = np.where(self.in_repr, np.cumsum(self.in_repr) - 1, -1)
+
+    @staticmethod
+    def read_features(repr, n_sents):
+        # Feature matrix and number of representations of every sentence.
+        # The memory-mapped store already is one contiguous matrix.
+        if isinstance(repr, ReprStore):
+            return repr.array, np.diff(repr.offsets)[:n_sents]
+        if n_sents == 0:
+            return np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.int64)
+        # Shapes come from the .npy headers, so the matrix is allocated
+        # once and every member is decompressed once while filling it.
+        shapes = [npz_shape(repr, str(idx)) for idx in range(n_sents)]
+        n_repr = np.array([shape[0] for shape in shapes], dtype=np.int64)
+        features = np.empty((n_repr.sum(), shapes[0][-1]), dtype=np.float32)
+        row = 0
+        for idx, n in enumerate(n_repr):
+            features[row:row+n] = repr[str(idx)]
+            row += n
+        return features, n_repr
+
+    def __len__(self):
+        return len(self.rows)
+
+    def classes(self, property):
+        return self.corpus.label_index(property).classes
+
+    def label_codes(self, property):
+        # Label code of every token, -1 if the token does not have the property.
+        if property not in self._label_codes:
+            index = self.corpus.label_index(property)
+            codes = np.full(len(self), -1, dtype=np.int32)
+            codes[index.positions] = index.codes
+            self._label_codes[property] = codes
+        return self._label_codes[property]
+
+    def mask(self, property=None, truncate=True):
+        # Tokens that have the property and, if truncate is set, a representation.
+        mask = np.ones(len(self), dtype=bool)
+        if property is not None:
+            mask &= self.label_codes(property) >= 0
+        if truncate:
+            mask &= self.in_repr
+        return mask
+
+    def features_at(self, positions):
+        # Features of the tokens at sorted positions, a view without a copy
+        # if their rows are contiguous (e.g. all tokens of the split).
+        rows = self.rows[positions]
+        if len(rows) > 0 and np.all(np.diff(rows) == 1):
+            return self.features[rows[0]:rows[-1] + 1]
+        return self.features[rows]
@@ -1,5 +1,8 @@
+import numpy as np
 from sklearn.metrics import accuracy_score, balanced_accuracy_score
 
+from .features import FeatureExtractor
+
 class MajorityBaseline:
 
     PROPERTIES = {
@@ -10,8 +13,11 @@ class MajorityBaseline:
         "Gender"
     }
 
-    def __init__(self, data, property="upos") -> None:
+    def __init__(self, data, property="upos", extractor=None) -> None:
         self.data = data
+        if extractor is None:
+            extractor = FeatureExtractor(data)
+        self.extractor = extractor
 
         if property not in self.PROPERTIES:
             raise ValueError(f"{property} must be one of the following {self.PROPERTIES}")
@@ -22,46 +28,44 @@ class MajorityBaseline:
 
     
     def train(self):
-        counts = dict()
-        overall_counts = dict()
-        for sent in self.data.train():
-            for word in sent: 
-                if self.property == "upos":
-                    ling_feat = word.upos
-                else:
-                    feats = word.feats
-                    if self.property not in feats:
-                        continue
-                    ling_feat = feats[self.property]
-                counts.setdefault(word.form, dict())
-                counts[word.form].setdefault(ling_feat, 0)
-                overall_counts.setdefault(ling_feat, 0)
-                counts[word.form][ling_feat] += 1
-                overall_counts[ling_feat] += 1
-        self.majority_votes = {
-            word_form: max(counts[word_form], key=counts[word_form].get)
-            for word_form in counts
-        }
-        self.most_common_overall = max(overall_counts, key=overall_counts.get)
+        split_features = self.extractor.split("train")
+        positions = np.flatnonzero(split_features.mask(self.property, truncate=False))
+        form_ids = split_features.form_ids[positions].astype(np.int64)
+        labels = split_features.label_codes(self.property)[positions].astype(np.int64)
+        if len(positions) == 0:
+            raise ValueError("No training data.")
+        # Count (form, label) pairs. Ties are broken by the first
+        # occurrence of the pair, as max() over the counts in insertion
+        # order did.
+        n_labels = labels.max() + 1
+        pairs, first, counts = np.unique(
+            form_ids * n_labels + labels, return_index=True, return_counts=True
+        )
+        pair_forms = pairs // n_labels
+        order = np.lexsort((first, -counts, pair_forms))
+        is_best = np.ones(len(order), dtype=bool)
+        is_best[1:] = pair_forms[order][1:] != pair_forms[order][:-1]
+        best = order[is_best]
+
+        overall_counts = np.bincount(labels, minlength=n_labels)
+        overall_first = np.full(n_labels, len(labels))
+        np.minimum.at(overall_first, labels, np.arange(len(labels)))
+        overall_order = np.lexsort((overall_first, -overall_counts))
+        self.most_common_overall = int(overall_order[0])
+
+        # Majority label of every form id, indexed by form id.
+        self.majority_votes = np.full(pair_forms.max() + 1, self.most_common_overall, dtype=np.int64)
+        self.majority_votes[pair_forms[best]] = pairs[best] % n_labels
     
     def test(self):
-        y_pred = []
-        y_true = []
-        for sent in self.data.test():
-            for word in sent:
-                if self.property == "upos":
-                    ling_feat = word.upos
-                else:
-                    feats = word.feats
-                    if self.property not in feats:
-                        continue
-                    ling_feat = feats[self.property]
-                pred = self.majority_votes.get(
-                    word.form,
-                    self.most_common_overall
-                )
-                y_true.append(ling_feat)
-                y_pred.append(pred)
+        split_features = self.extractor.split("test")
+        positions = np.flatnonzero(split_features.mask(self.property, truncate=False))
+        form_ids = split_features.form_ids[positions]
+        y_true = split_features.label_codes(self.property)[positions]
+        # Forms not seen in training get the overall majority label.
+        y_pred = np.full(len(positions), self.most_common_overall, dtype=np.int64)
+        known = form_ids < len(self.majority_votes)
+        y_pred[known] = self.majority_votes[form_ids[known]]
         return y_pred, y_true
     
     def evaluate(self):
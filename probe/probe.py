@@ -1,20 +1,70 @@
-
 import torch
 
 def get_original_word_representations(ids, model, mapping, layer_idx=-1):
     output = model(ids, output_hidden_states=True)
-    output = torch.squeeze(output[layer_idx][0], dim=0)
-    # We don't need representations of [CLS] and [SEP]
-    output = output[1:-1]
-    # Average representations of subwords for the mapped indices.
-    aggr_repr = torch.zeros(size=(len(mapping), output.shape[-1]))
-    for idx, (start, end) in enumerate(mapping):
-        if end - start > 1:
-            mean = torch.mean(output[start:end], dim=0)
-            aggr_repr[idx] += mean
-        else:
-            aggr_repr[idx] += output[start]
-    return aggr_repr
+    output = output[layer_idx][0]
+    return pool_subwords(output, [mapping])
+
+def get_batch_word_representations(ids_list, model, mappings, layer_idx=-1, pad_id=0, layers=None):
+    batch_ids, attention_mask = pad_ids(ids_list, pad_id=pad_id)
+    with torch.no_grad():
+        output = model(
+            batch_ids,
+            attention_mask=attention_mask,
+            output_hidden_states=True
+        )
+    if layers is None:
+        output = output[layer_idx][0]
+        pooled = pool_subwords(output, mappings)
+    else:
+        # Pool all requested hidden states at once by stacking them along
+        # the hidden dimension: (batch, seq_len, n_layers * hidden)
+        hidden = torch.stack([output.hidden_states[l] for l in layers], dim=2)
+        batch_size, seq_len, n_layers, hidden_size = hidden.shape
+        hidden = hidden.reshape(batch_size, seq_len, n_layers * hidden_size)
+        pooled = pool_subwords(hidden, mappings)
+        pooled = pooled.reshape(-1, n_layers, hidden_size)
+    return list(torch.split(pooled, [len(mapping) for mapping in mappings]))
+
+def pool_subwords(output, mappings):
+    # Average representations of subwords for the mapped indices of
+    # all sentences in a (padded) batch with a single index_add.
+    positions, word_idx, lengths = subword_index(mappings, seq_len=output.shape[1])
+    hidden = output.reshape(-1, output.shape[-1])
+    pooled = torch.zeros(size=(lengths.shape[0], hidden.shape[-1]), dtype=hidden.dtype)
+    pooled.index_add_(0, word_idx, hidden[positions])
+    return pooled / lengths.unsqueeze(-1)
+
+def subword_index(mappings, seq_len):
+    spans = torch.tensor(
+        [span for mapping in mappings for span in mapping],
+        dtype=torch.long
+    ).reshape(-1, 2)
+    n_words = torch.tensor([len(mapping) for mapping in mappings], dtype=torch.long)
+    # Position of each word's first subword in the flattened batch,
+    # skipping [CLS]. Words without subwords use the following one.
+    sent_offsets = torch.arange(len(mappings), dtype=torch.long) * seq_len + 1
+    starts = spans[:, 0] + torch.repeat_interleave(sent_offsets, n_words)
+    lengths = torch.clamp(spans[:, 1] - spans[:, 0], min=1)
+    word_idx = torch.repeat_interleave(torch.arange(spans.shape[0]), lengths)
+    first_subword = torch.cumsum(lengths, dim=0) - lengths
+    within_word = torch.arange(word_idx.shape[0]) - first_subword[word_idx]
+    positions = starts[word_idx] + within_word
+    return positions, word_idx, lengths
+
+def pad_ids(ids_list, pad_id=0):
+    max_len = max(ids.shape[-1] for ids in ids_list)
+    batch_ids = torch.full(
+        size=(len(ids_list), max_len),
+        fill_value=pad_id,
+        dtype=torch.int
+    )
+    attention_mask = torch.zeros(size=(len(ids_list), max_len), dtype=torch.int)
+    for idx, ids in enumerate(ids_list):
+        length = ids.shape[-1]
+        batch_ids[idx, :length] = ids[0]
+        attention_mask[idx, :length] = 1
+    return batch_ids, attention_mask
 
 def convert_to_ids(word_list, tokenizer, max_len=512):
     tokenized = []
@@ -31,4 +81,36 @@ def convert_to_ids(word_list, tokenizer, max_len=512):
         subwords_idx = new_idx
     input_seq = ["[CLS]"] + tokenized + ["[SEP]"]
     ids = tokenizer.convert_tokens_to_ids(input_seq)
-    return mapping, torch.unsqueeze(torch.IntTensor(ids), dim=0)
\ No newline at end of file
+    return mapping, torch.unsqueeze(torch.IntTensor(ids), dim=0)
+
+
+def convert_to_ids_batch(word_lists, tokenizer, max_len=512):
+    # Same (mapping, ids) as convert_to_ids for every sentence, but
+    # tokenized at once with a fast tokenizer.
+    if not getattr(tokenizer, "is_fast", False):
+        return [convert_to_ids(words, tokenizer=tokenizer, max_len=max_len) for words in word_lists]
+    non_empty = [idx for idx, words in enumerate(word_lists) if len(words) > 0]
+    encoding = tokenizer(
+        [list(word_lists[idx]) for idx in non_empty],
+        is_split_into_words=True,
+        add_special_tokens=False
+    )
+    converted = [([], empty_ids(tokenizer))] * len(word_lists)
+    for enc_idx, idx in enumerate(non_empty):
+        subword_ids = encoding["input_ids"][enc_idx]
+        word_ids = torch.tensor(encoding.word_ids(enc_idx), dtype=torch.long)
+        lengths = torch.bincount(word_ids, minlength=len(word_lists[idx]))
+        ends = torch.cumsum(lengths, dim=0)
+        # Keep the words that fit into max_len with [CLS] and [SEP].
+        n_words = int((ends + 2 <= max_len).sum())
+        ends = ends[:n_words]
+        starts = ends - lengths[:n_words]
+        mapping = list(zip(starts.tolist(), ends.tolist()))
+        n_subwords = int(ends[-1]) if n_words > 0 else 0
+        ids = [tokenizer.cls_token_id] + subword_ids[:n_subwords] + [tokenizer.sep_token_id]
+        converted[idx] = (mapping, torch.unsqueeze(torch.IntTensor(ids), dim=0))
+    return converted
+
+def empty_ids(tokenizer):
+    ids = [tokenizer.cls_token_id, tokenizer.sep_token_id]
+    return torch.unsqueeze(torch.IntTensor(ids), dim=0)
@@ -1,7 +1,11 @@
+import numpy as np
 from sklearn.linear_model import SGDClassifier
 from sklearn.neural_network import MLPClassifier
 from sklearn.metrics import accuracy_score, balanced_accuracy_score
 
+from .features import FeatureExtractor
+from .torch_classifiers import TorchClassifier
+
 class ClassifierProbe:
 
     PROPERTIES = {
@@ -14,15 +18,24 @@ class ClassifierProbe:
 
     CLFS = {
         "SGD", 
-        "MLP"
+        "MLP",
+        "TorchLR",
+        "TorchMLP"
     }
 
 
-    def __init__(self, data, train_repr, test_repr, clf_type, property="upos") -> None:
+    def __init__(self, data, train_repr, test_repr, clf_type, property="upos", extractor=None, chunk_size=None, epochs=5) -> None:
         self.data = data
         self.train_repr = train_repr
         self.test_repr = test_repr
         self.classes = None
+        # With a chunk size, training streams chunks of tokens through
+        # partial_fit instead of fitting on the whole split at once.
+        self.chunk_size = chunk_size
+        self.epochs = epochs
+        if extractor is None:
+            extractor = FeatureExtractor(data, train_repr, test_repr)
+        self.extractor = extractor
 
         if property not in self.PROPERTIES:
             raise ValueError(f"{property} must be one of the following {self.PROPERTIES}")
@@ -32,51 +45,92 @@ class ClassifierProbe:
         if clf_type not in self.CLFS:
             raise ValueError(f"Invalid classifier type. Must be on of {self.CLFS}")
         
+        # Each classifier gets its own random state drawn from the global
+        # numpy state, so that probes trained in parallel threads are
+        # reproducible.
+        random_state = np.random.randint(2**31 - 1)
+        # Order of the chunks in incremental training.
+        self.chunk_rng = np.random.default_rng(random_state)
         if clf_type == "SGD":
-            self.clf = SGDClassifier()
+            self.clf = SGDClassifier(random_state=random_state)
         if clf_type == "MLP":
-            self.clf = MLPClassifier(hidden_layer_sizes=(2,))
+            self.clf = MLPClassifier(hidden_layer_sizes=(2,), random_state=random_state)
+        if clf_type == "TorchLR":
+            self.clf = TorchClassifier(optimizer="lbfgs", seed=random_state)
+        if clf_type == "TorchMLP":
+            self.clf = TorchClassifier(hidden_size=2, optimizer="adam", seed=random_state)
     
+    def get_positions(self, split):
+        # Tokens of the split that are used by the probe.
+        split_features = self.extractor.split(split)
+        positions = np.flatnonzero(split_features.mask(self.property))
+        labels = split_features.label_codes(self.property)[positions]
+        class_names = split_features.classes(self.property)
+        self.classes = {class_names[code] for code in set(labels.tolist())}
+        return positions
+
+    def get_chunk(self, split, positions):
+        split_features = self.extractor.split(split)
+        features = split_features.features_at(positions)
+        return features, split_features.label_codes(self.property)[positions]
+
+    def get_train_classes(self, positions):
+        # All classes must be known before the first call to partial_fit.
+        split_features = self.extractor.split("train")
+        return np.unique(split_features.label_codes(self.property)[positions])
+
+    def iter_chunks(self, split, positions):
+        for start in range(0, len(positions), self.chunk_size):
+            yield self.get_chunk(split, positions[start:start+self.chunk_size])
+
     def get_features_and_labels(self, split):
-        if split not in ("train", "test"):
-            raise ValueError(f"{split} must be either 'train' or 'test'.")
-        
-        # Decide for train or test split
-        if split == "train":
-            sents = self.data.train()
-            repr = self.train_repr
-        else:
-            sents = self.data.test()
-            repr = self.test_repr
-        
-        features = []
-        labels = []
-        for idx, sent in enumerate(sents):
-            if self.property == "upos": #Extract POS tags
-                bert_repr = repr[str(idx)]
-                tags = [w.upos for w in sent][:bert_repr.shape[0]] # Truncate!
-                features.extend(bert_repr)
-                labels.extend(tags)
-            else: # Extract given features of properties
-                bert_repr = repr[str(idx)]
-                for i in range(bert_repr.shape[0]):
-                    feats = sent[i].feats
-                    if self.property in feats:
-                        labels.append(feats[self.property])
-                        features.append(bert_repr[i])
-        self.classes = set(labels)
-        return features, labels
+        return self.get_chunk(split, self.get_positions(split))
 
     def train(self):
+        if self.chunk_size is not None:
+            self.train_incremental()
+            return
+        fit_params = dict()
+        if isinstance(self.clf, TorchClassifier):
+            # Early stopping on the dev split, before the train classes are set.
+            fit_params["X_val"], fit_params["y_val"] = self.get_validation_data()
         features, labels = self.get_features_and_labels("train")
         self.clf.fit(
             features, 
-            labels
+            labels,
+            **fit_params
         )
+
+    def get_validation_data(self):
+        if self.extractor.dev_repr is None:
+            return None, None
+        return self.get_features_and_labels("dev")
+
+    def train_incremental(self):
+        # Only one chunk of features is in memory at a time.
+        positions = self.get_positions("train")
+        if len(positions) == 0:
+            raise ValueError("No training data.")
+        classes = self.get_train_classes(positions)
+        n_chunks = -(-len(positions) // self.chunk_size)
+        for _ in range(self.epochs):
+            # Visit the chunks in a different order in every epoch.
+            for chunk in self.chunk_rng.permutation(n_chunks):
+                start = chunk * self.chunk_size
+                features, labels = self.get_chunk("train", positions[start:start+self.chunk_size])
+                self.clf.partial_fit(features, labels, classes=classes)
     
     def test(self):
-        features, labels = self.get_features_and_labels("test")
-        return self.clf.predict(features), labels
+        positions = self.get_positions("test")
+        if self.chunk_size is None or len(positions) == 0:
+            features, labels = self.get_chunk("test", positions)
+            return self.clf.predict(features), labels
+        y_pred = []
+        y_true = []
+        for features, labels in self.iter_chunks("test", positions):
+            y_pred.append(self.clf.predict(features))
+            y_true.append(np.asarray(labels))
+        return np.concatenate(y_pred), np.concatenate(y_true)
 
     def evaluate(self):
         y_pred, y_true = self.test()
@@ -1,43 +1,32 @@
 import numpy as np
 
+from utils.read_conllu import Word
 from .probe_classifiers import ClassifierProbe
 
 
 class RandomBaseline(ClassifierProbe):
 
-    def __init__(self, data, train_repr, test_repr, clf_type, property="upos") -> None:
-        super().__init__(data, train_repr, test_repr, clf_type, property)
-        self.random_word_form_repr = dict()
+    def __init__(self, data, train_repr, test_repr, clf_type, property="upos", extractor=None, chunk_size=None, epochs=5, seed=None) -> None:
+        super().__init__(data, train_repr, test_repr, clf_type, property, extractor, chunk_size, epochs)
+        # Without a seed, the table follows the global numpy random state.
+        if seed is None:
+            seed = np.random.randint(2**31 - 1)
+        self.rng = np.random.default_rng(seed)
+        # One random float32 vector per word form, indexed by form id.
+        self.random_word_form_repr = None
 
-    def get_features_and_labels(self, split):
-        if split not in ("train", "test"):
-            raise ValueError(f"{split} must be either 'train' or 'test'.")
-        
-        # Decide for train or test split
-        if split == "train":
-            sents = self.data.train()
-            repr = self.train_repr
-        else:
-            sents = self.data.test()
-            repr = self.test_repr
-        features = []
-        labels = []
-        for idx, sent in enumerate(sents):
-            bert_repr = repr[str(idx)]
-            for i in range(bert_repr.shape[0]):
-                word = sent[i]
-                if self.property == "upos":
-                    ling_feat = word.upos
-                else:
-                    feats = word.feats
-                    if self.property not in feats:
-                        continue
-                    ling_feat = feats[self.property]
-                self.random_word_form_repr.setdefault(
-                    word.form, 
-                    np.random.rand(*bert_repr[i].shape)
-                )
-                features.append(self.random_word_form_repr[word.form])
-                labels.append(ling_feat)
-        return features, labels
-        
\ No newline at end of file
+    def get_random_repr(self, form_ids):
+        if self.random_word_form_repr is None:
+            # All splits share the form vocabulary, so one table covers
+            # them. The hidden size is taken from train, as other splits
+            # (e.g. a missing dev split) may have no representations.
+            train_features = self.extractor.split("train")
+            n_forms = len(train_features.corpus.vocabs[Word.INDEX["form"]])
+            hidden_size = train_features.features.shape[-1]
+            self.random_word_form_repr = self.rng.random((n_forms, hidden_size), dtype=np.float32)
+        return self.random_word_form_repr[form_ids]
+
+    def get_chunk(self, split, positions):
+        split_features = self.extractor.split(split)
+        features = self.get_random_repr(split_features.form_ids[positions])
+        return features, split_features.label_codes(self.property)[positions]
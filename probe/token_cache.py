@@ -0,0 +1,91 @@
+import hashlib
+import os
+
+import numpy as np
+
+from utils.read_conllu import Corpus, Word
+from .probe import convert_to_ids_batch
+
+
+# Subword ids of all sentences of a corpus as returned by convert_to_ids,
+# i.e. with [CLS] and [SEP], stored flat with sentence offsets. The number
+# of subwords of every (not truncated) word is kept as well.
+class TokenIds:
+
+    def __init__(self, ids, offsets, word_lengths, word_offsets) -> None:
+        self.ids = ids
+        self.offsets = offsets
+        self.word_lengths = word_lengths
+        self.word_offsets = word_offsets
+
+    def sentence(self, idx):
+        return self.ids[self.offsets[idx]:self.offsets[idx+1]]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __repr__(self) -> str:
+        return "TokenIds(#sents={}, #ids={})".format(len(self), len(self.ids))
+
+    @classmethod
+    def from_converted(cls, converted):
+        ids = [ids[0].numpy() for _, ids in converted]
+        word_lengths = [[end - start for start, end in mapping] for mapping, _ in converted]
+        return cls(
+            ids=np.concatenate(ids).astype(np.int32) if ids else np.empty(0, dtype=np.int32),
+            offsets=lengths_to_offsets([len(sent) for sent in ids]),
+            word_lengths=np.array([l for sent in word_lengths for l in sent], dtype=np.int32),
+            word_offsets=lengths_to_offsets([len(sent) for sent in word_lengths])
+        )
+
+    def save(self, path):
+        np.savez(
+            path,
+            ids=self.ids,
+            offsets=self.offsets,
+            word_lengths=self.word_lengths,
+            word_offsets=self.word_offsets
+        )
+
+    @classmethod
+    def load(cls, path):
+        arrays = np.load(path)
+        return cls(**{name: arrays[name] for name in arrays.files})
+
+
+def lengths_to_offsets(lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+def corpus_forms(corpus):
+    forms = np.array(corpus.vocabs[Word.INDEX["form"]].itos, dtype=object)
+    return forms[corpus.form_ids]
+
+def corpus_hash(corpus):
+    h = hashlib.sha1()
+    h.update(corpus.offsets.tobytes())
+    h.update("\t".join(corpus_forms(corpus).tolist()).encode("utf-8"))
+    return h.hexdigest()
+
+def load_token_ids(sents, tokenizer, cache_dir, max_len=512):
+    # Tokenize a corpus or read its subword ids from the cache, which is
+    # keyed by tokenizer name, max_len and a hash of the word forms.
+    corpus = Corpus.from_sentences(sents)
+    tokenizer_name = tokenizer.name_or_path.strip("/").replace("/", "_")
+    path = os.path.join(
+        cache_dir,
+        f"{tokenizer_name}-{max_len}-{corpus_hash(corpus)}.npz"
+    )
+    if os.path.exists(path):
+        return TokenIds.load(path)
+    forms = corpus_forms(corpus).tolist()
+    word_lists = [
+        forms[start:end]
+        for start, end in zip(corpus.offsets[:-1], corpus.offsets[1:])
+    ]
+    converted = convert_to_ids_batch(word_lists, tokenizer=tokenizer, max_len=max_len)
+    token_ids = TokenIds.from_converted(converted)
+    os.makedirs(cache_dir, exist_ok=True)
+    token_ids.save(path)
+    return token_ids
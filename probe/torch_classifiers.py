@@ -0,0 +1,163 @@
+import copy
+import math
+
+import numpy as np
+import torch
+from torch import nn
+
+
+def to_tensor(features):
+    # Float32 data path, without a copy if the features already are float32.
+    features = np.ascontiguousarray(features, dtype=np.float32)
+    # torch cannot share read-only memory, e.g. slices of the memory-mapped
+    # store, so these are copied once.
+    if not features.flags.writeable:
+        features = features.copy()
+    return torch.from_numpy(features)
+
+
+class TorchClassifier:
+    # Multinomial logistic regression (hidden_size=None) or MLP with one
+    # hidden layer, trained full-batch on CPU with the same fit/predict
+    # interface as the sklearn classifiers. If validation data is given,
+    # training stops early once the validation accuracy stops improving
+    # and the best parameters are kept.
+
+    def __init__(self, hidden_size=None, optimizer="lbfgs", lr=None, alpha=1e-4, max_iter=200, eval_every=10, patience=3, batch_size=256, n_threads=None, seed=None) -> None:
+        if optimizer not in ("lbfgs", "adam"):
+            raise ValueError(f"Invalid optimizer {optimizer}. Must be one of lbfgs, adam.")
+        self.hidden_size = hidden_size
+        self.optimizer = optimizer
+        if lr is None:
+            lr = 1.0 if optimizer == "lbfgs" else 1e-2
+        self.lr = lr
+        self.alpha = alpha # L2 penalty, as in sklearn
+        self.max_iter = max_iter
+        self.eval_every = eval_every
+        self.patience = patience
+        self.batch_size = batch_size # Only used by partial_fit
+        self.n_threads = n_threads # Defaults to all intra-op threads of torch
+        # Own generator, so that classifiers trained in parallel threads
+        # stay reproducible. Without a seed, it follows the global numpy
+        # random state.
+        if seed is None:
+            seed = np.random.randint(2**31 - 1)
+        self.generator = torch.Generator().manual_seed(int(seed))
+        self.classes_ = None
+        self.model = None
+        self._partial_optimizer = None
+
+    def build_model(self, n_features, n_classes):
+        if self.hidden_size is None:
+            model = nn.Linear(n_features, n_classes)
+        else:
+            model = nn.Sequential(
+                nn.Linear(n_features, self.hidden_size),
+                nn.ReLU(),
+                nn.Linear(self.hidden_size, n_classes)
+            )
+        # Same initialization as nn.Linear, drawn from our generator.
+        with torch.no_grad():
+            for layer in model.modules():
+                if isinstance(layer, nn.Linear):
+                    bound = 1 / math.sqrt(layer.in_features)
+                    for param in (layer.weight, layer.bias):
+                        param.copy_((torch.rand(param.shape, generator=self.generator) * 2 - 1) * bound)
+        return model
+
+    def build_optimizer(self, optimizer):
+        if optimizer == "lbfgs":
+            return torch.optim.LBFGS(
+                self.model.parameters(),
+                lr=self.lr,
+                max_iter=self.eval_every,
+                history_size=10,
+                line_search_fn="strong_wolfe"
+            )
+        # partial_fit always uses Adam, with its default step size for L-BFGS models.
+        lr = self.lr if self.optimizer == "adam" else 1e-2
+        return torch.optim.Adam(self.model.parameters(), lr=lr)
+
+    def init(self, n_features, classes):
+        self.classes_ = np.asarray(classes)
+        self.model = self.build_model(n_features, len(self.classes_))
+
+    def encode(self, labels):
+        return torch.from_numpy(np.searchsorted(self.classes_, np.asarray(labels)).astype(np.int64))
+
+    def loss(self, features, targets):
+        loss = nn.functional.cross_entropy(self.model(features), targets)
+        weights = [param for name, param in self.model.named_parameters() if name.endswith("weight")]
+        return loss + self.alpha / 2 * sum((w ** 2).sum() for w in weights)
+
+    def steps(self, optimizer, features, targets):
+        # Runs eval_every iterations over the full batch.
+        def closure():
+            optimizer.zero_grad()
+            loss = self.loss(features, targets)
+            loss.backward()
+            return loss
+        if isinstance(optimizer, torch.optim.LBFGS):
+            optimizer.step(closure)
+        else:
+            for _ in range(self.eval_every):
+                optimizer.step(closure)
+
+    def fit(self, X, y, X_val=None, y_val=None):
+        if len(X) == 0:
+            raise ValueError("No training data.")
+        n_threads = torch.get_num_threads()
+        if self.n_threads is not None:
+            torch.set_num_threads(self.n_threads)
+        try:
+            features = to_tensor(X)
+            self.init(features.shape[1], np.unique(y))
+            targets = self.encode(y)
+            validate = X_val is not None and len(X_val) > 0
+            optimizer = self.build_optimizer(self.optimizer)
+
+            best_acc = -1
+            best_state = None
+            n_worse = 0
+            for _ in range(0, self.max_iter, self.eval_every):
+                self.model.train()
+                self.steps(optimizer, features, targets)
+                if not validate:
+                    continue
+                acc = np.mean(self.predict(X_val) == np.asarray(y_val))
+                if acc > best_acc:
+                    best_acc = acc
+                    best_state = copy.deepcopy(self.model.state_dict())
+                    n_worse = 0
+                else:
+                    n_worse += 1
+                    if n_worse >= self.patience:
+                        break
+            if best_state is not None:
+                self.model.load_state_dict(best_state)
+        finally:
+            torch.set_num_threads(n_threads)
+        return self
+
+    def partial_fit(self, X, y, classes=None):
+        # One pass of minibatch Adam over a chunk of training data.
+        features = to_tensor(X)
+        if self.model is None:
+            if classes is None:
+                raise ValueError("classes must be passed on the first call to partial_fit.")
+            self.init(features.shape[1], classes)
+            self._partial_optimizer = self.build_optimizer("adam")
+        targets = self.encode(y)
+        self.model.train()
+        for batch in torch.randperm(len(features), generator=self.generator).split(self.batch_size):
+            self._partial_optimizer.zero_grad()
+            loss = self.loss(features[batch], targets[batch])
+            loss.backward()
+            self._partial_optimizer.step()
+        return self
+
+    def predict(self, X):
+        self.model.eval()
+        with torch.no_grad():
+            scores = self.model(to_tensor(X))
+        return self.classes_[scores.argmax(dim=1).numpy()]
@@ -1,31 +1,69 @@
-#  Calculate vocabulary overlap.
+#  Calculate proportion of unknown tokens.
 
-from probe.probe import convert_to_ids
-from utils.read_conllu import Data
+from probe.token_cache import load_token_ids
+from utils.read_conllu import load_preprocessed
 
 import argparse
-import json
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+import numpy as np
 import pandas as pd
 import os
-from transformers import BertTokenizer, BertModel
-from tqdm import tqdm
+from transformers import BertTokenizerFast
 
-def load_json(path):
-    with open(path, encoding="utf-8") as file:
-        split_dict = json.load(file)
-    return Data.from_json(split_dict)
+def get_prop_unk(token_ids, tok_id):
+    # Proportion of all ids, including [CLS] and [SEP].
+    return float(np.mean(token_ids.ids == tok_id))
 
-def get_prop_unk(sent_list, tokenizer, tok_id):
-    unk_counter = 0
-    token_count = 0
-    for sent in sent_list:
-        words = [w.form for w in sent]
-        _, ids = convert_to_ids(words, tokenizer=tokenizer)
-        token_count += len(ids[0])
-        for i in ids[0]:
-            if i == tok_id:
-                unk_counter += 1
-    return unk_counter / token_count
+def get_unk_stats(token_ids, tok_id):
+    is_unk = token_ids.ids == tok_id
+    # Drop [CLS] and [SEP], which are the first and last id of every sentence.
+    is_special = np.zeros(len(is_unk), dtype=bool)
+    is_special[token_ids.offsets[:-1]] = True
+    is_special[token_ids.offsets[1:] - 1] = True
+    subword_unk = is_unk[~is_special]
+    sent_lengths = np.diff(token_ids.offsets) - 2
+    sent_idx = np.repeat(np.arange(len(token_ids)), sent_lengths)
+    # Words count as unknown if any of their subwords is [UNK].
+    word_idx = np.repeat(np.arange(len(token_ids.word_lengths)), token_ids.word_lengths)
+    word_unk = np.bincount(word_idx, weights=subword_unk, minlength=len(token_ids.word_lengths)) > 0
+    # Rate of unknown subwords per sentence, for sentences with subwords.
+    sent_unk = np.bincount(sent_idx, weights=subword_unk, minlength=len(token_ids))
+    sent_rate = sent_unk[sent_lengths > 0] / sent_lengths[sent_lengths > 0]
+    return {
+        "UNK Prop": get_prop_unk(token_ids, tok_id),
+        "Subword UNK Prop": float(subword_unk.mean()),
+        "Word UNK Prop": float(word_unk.mean()),
+        "Sentences with UNK": float(np.mean(sent_rate > 0)),
+        "Sentence UNK Mean": float(sent_rate.mean()),
+        "Sentence UNK Std": float(sent_rate.std()),
+        "Sentence UNK Median": float(np.median(sent_rate)),
+        "Sentence UNK 90th Percentile": float(np.percentile(sent_rate, 90)),
+        "Sentence UNK Max": float(sent_rate.max()),
+    }
+
+@lru_cache(maxsize=None)
+def load_tokenizer(pretrained):
+    # Loaded once per process.
+    return BertTokenizerFast.from_pretrained(pretrained)
+
+def process_language(language, data_dir, pretrained, cache_dir=None, unk_token_id=None):
+    print("Processing language {}".format(language))
+    path = os.path.join(data_dir, language)
+    data = load_preprocessed(path)
+    train_sents = data.train()
+    if len(train_sents) == 0:
+        return None
+    if cache_dir is not None:
+        cache_dir = os.path.join(cache_dir, language)
+    else:
+        cache_dir = os.path.join(path, "token_cache")
+    tokenizer = load_tokenizer(pretrained)
+    if unk_token_id is None:
+        unk_token_id = tokenizer.unk_token_id
+    token_ids = load_token_ids(train_sents, tokenizer, cache_dir=cache_dir)
+    stats = get_unk_stats(token_ids, tok_id=unk_token_id)
+    return {"Language": language, **stats}
 
 if __name__ == "__main__":
     # Set up argument parser.
@@ -33,32 +71,27 @@ if __name__ == "__main__":
     parser.add_argument("--data_dir")
     parser.add_argument("--pretrained")
     parser.add_argument("--out_dir")
-    parser.add_argument("--unk_token_id", default=100)
+    parser.add_argument("--unk_token_id", type=int, help="Defaults to the [UNK] id of the tokenizer.")
+    parser.add_argument("--cache_dir", help="Directory of cached subword ids, defaults to token_cache in each language directory.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of languages processed in parallel.")
     args = parser.parse_args()
-    unk_token_id = args.unk_token_id
-    out_dir = args.out_dir #"results/vocab_overlap.tsv"
+    out_dir = args.out_dir #"results/prop_unk.tsv"
     data_dir = args.data_dir # "preprocessed"
     pretrained = args.pretrained#"google-bert/bert-base-multilingual-cased"
 
-    # Load Tokenizer
-    tokenizer = BertTokenizer.from_pretrained(pretrained)
-
     langs = os.listdir(data_dir)
-    langs_ids = dict()
+    run = partial(
+        process_language,
+        data_dir=data_dir,
+        pretrained=pretrained,
+        cache_dir=args.cache_dir,
+        unk_token_id=args.unk_token_id
+    )
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            rows = list(pool.map(run, langs))
+    else:
+        rows = [run(language) for language in langs]
 
-    data_dict = {"Language": [], "UNK Prop": []}
-    for language in langs:
-        print("Processing language {}".format(language))
-        path = os.path.join(data_dir, language)
-        data = load_json(os.path.join(path, "preprocessed.json"))
-        train_sents = data.train()
-        if len(train_sents) == 0:
-            continue
-        prop_unk = get_prop_unk(train_sents, tokenizer, tok_id=unk_token_id)
-        data_dict["Language"].append(language)
-        data_dict["UNK Prop"].append(prop_unk)
-    
-    df = pd.DataFrame(data_dict)
+    df = pd.DataFrame([row for row in rows if row is not None])
     df.to_csv(out_dir, sep="\t")
-    
-
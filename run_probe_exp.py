@@ -1,66 +1,158 @@
 import argparse
-import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 import os
+import random
 
 import numpy as np
 import pandas as pd
+from threadpoolctl import threadpool_limits
+import torch
 
-from utils.read_conllu import Data
+from utils.layers import parse_layers, repr_name
+from utils.read_conllu import load_preprocessed
+from utils.repr_store import ReprStore, load_repr, repr_exists
+from utils.result_store import ResultStore, data_fingerprint
+from probe.features import FeatureExtractor
 from probe.probe_classifiers import ClassifierProbe
 from probe.majority_probe import MajorityBaseline
 from probe.random_probe import RandomBaseline
 from probe.control_task_probe import ControlTaskProbe
 
-def load_json(path):
-    with open(path, encoding="utf-8") as file:
-        split_dict = json.load(file)
-    return Data.from_json(split_dict)
-
-parser = argparse.ArgumentParser("Run probing experiments.")
-parser.add_argument("--preprocessed_dir")
-parser.add_argument("--out_path")
-parser.add_argument("--property")
-parser.add_argument("--clf_type")
-
-args = parser.parse_args()
-
-preprocessed_dir = args.preprocessed_dir
-langs = os.listdir(preprocessed_dir)
-out = args.out_path
-property = args.property
-clf_type = args.clf_type
-
-data_df = {
-    "Language": [],
-    "Classes": [],
-    f"{clf_type} Accuracy": [],
-    f"{clf_type} Balanced Accuracy": [],
-    f"{clf_type} Sensitivity": [],
-    "Majority Baseline Balanced Accuracy": [],
-    "Random Baseline Balanced Accuracy": [],
-    "Majority Baseline Accuracy": [],
-    "Random Baseline Accuracy": [],
+def available_layers(path):
+    prefix = repr_name("train", layer="")
+    return sorted({
+        int(os.path.splitext(f)[0][len(prefix):]) for f in os.listdir(path)
+        if f.startswith(prefix) and os.path.splitext(f)[1] in (".npz", ".npy")
+        and not f.endswith("-offsets.npy")
+    })
+
+def result_columns(clf_type, layer_spec=None):
+    columns = [
+        "Language",
+        "Classes",
+        f"{clf_type} Accuracy",
+        f"{clf_type} Balanced Accuracy",
+        f"{clf_type} Sensitivity",
+        f"{clf_type} Sensitivity Std",
+        "Majority Baseline Balanced Accuracy",
+        "Random Baseline Balanced Accuracy",
+        "Majority Baseline Accuracy",
+        "Random Baseline Accuracy",
+    ]
+    if layer_spec is not None:
+        columns.append("Layer")
+    return columns
+
+def run_config(chunk_size=None, epochs=5, control_seeds=1):
+    # Settings that change results and are not the defaults, part of the
+    # key of stored results.
+    config = dict()
+    if chunk_size is not None:
+        config["chunk_size"] = chunk_size
+        config["epochs"] = epochs
+    if control_seeds != 1:
+        config["control_seeds"] = control_seeds
+    return config
+
+def data_files(path, layer=None):
+    # Preprocessed data and representations that results of a layer depend on.
+    files = [os.path.join(path, "preprocessed.json"), os.path.join(path, "preprocessed.npz")]
+    for split in ("train", "test", "dev"):
+        name = repr_name(split, layer)
+        files.extend(ReprStore.paths(path, name))
+        files.append(os.path.join(path, name + ".npz"))
+    return files
+
+def probe_language(lang, preprocessed_dir, properties, clf_types, store_path, layer_spec=None, seed=None, chunk_size=None, epochs=5, control_seeds=1, control_jobs=None):
+    path = os.path.join(preprocessed_dir, lang)
+    if layer_spec == "all":
+        layers = available_layers(path)
+    else:
+        # Only layers whose representations were saved by preprocess.py.
+        requested = parse_layers(layer_spec) or [None]
+        layers = [
+            layer for layer in requested
+            if repr_exists(path, repr_name("train", layer)) and repr_exists(path, repr_name("test", layer))
+        ]
+        missing = [layer for layer in requested if layer not in layers and layer is not None]
+        if layers and missing:
+            print(f"Skipped layers {missing} of {lang}, no representations found.")
+    if not layers:
+        if layer_spec is None:
+            print(f"Skipped {lang}, no representations found. Pass --layer for representations saved per layer.")
+        else:
+            print(f"Skipped {lang}, no representations found for --layer {layer_spec}. Run preprocess.py with matching --layers.")
+        return layers
+
+    # Skip cells that are already in the result store.
+    config = run_config(chunk_size, epochs, control_seeds)
+    data_ids = {layer: data_fingerprint(data_files(path, layer)) for layer in layers}
+    store = ResultStore(store_path)
+    pending = {
+        layer: [
+            (property, clf_type)
+            for property in properties for clf_type in clf_types
+            if not store.done(lang, property, clf_type, seed=seed, layer=layer, config=config, data=data_ids[layer])
+        ]
+        for layer in layers
     }
+    if not any(pending.values()):
+        print(f"Skipped {lang}, all results are stored.")
+        store.close()
+        return layers
 
-smaller_sample = ""
-for lang in langs:
     print("==="*30)
-    print(f"Train probe for {lang}...")
+    print(f"Train probes for {lang}...")
     # Load data
-    path = os.path.join(preprocessed_dir, lang)
-    data = load_json(os.path.join(path, "preprocessed.json"))
-    test_repr = np.load(os.path.join(path, "test.npz"))
-    train_repr = np.load(os.path.join(path, "train.npz"))
-    if len(train_repr) == 0:
-        print(f"No train data found for {lang}")
-        continue
-    if len(train_repr) < 500:
-        smaller_sample = "*"
-
-    clf_probe = ClassifierProbe(data=data, train_repr=train_repr, test_repr=test_repr, clf_type=clf_type , property=property)
-    majority_baseline = MajorityBaseline(data=data, property=property)
-    random_baseline = RandomBaseline(data=data, train_repr=train_repr, test_repr=test_repr, clf_type=clf_type , property=property)
-    control_probe = ControlTaskProbe(data=data, train_repr=train_repr, test_repr=test_repr, clf_type=clf_type , property=property)
+    data = load_preprocessed(path)
+
+    # The majority baseline does not depend on representations.
+    majority_accs = dict()
+
+    # All layers share the labels, only representations are swapped.
+    for layer in layers:
+        if not pending[layer]:
+            continue
+        test_repr = load_repr(path, repr_name("test", layer))
+        train_repr = load_repr(path, repr_name("train", layer))
+        # The dev split is only used for early stopping of torch probes.
+        dev_repr = None
+        if repr_exists(path, repr_name("dev", layer)):
+            dev_repr = load_repr(path, repr_name("dev", layer))
+        if len(train_repr) == 0:
+            print(f"No train data found for {lang}")
+            break
+        if layer is not None:
+            print(f"Layer {layer}")
+
+        # Tokens, labels and features are extracted once and shared by
+        # all probes of all properties.
+        extractor = FeatureExtractor(data=data, train_repr=train_repr, test_repr=test_repr, dev_repr=dev_repr)
+        for property, clf_type in pending[layer]:
+            print(f"{property}, {clf_type}")
+            if seed is not None:
+                random.seed(seed)
+                np.random.seed(seed)
+                torch.manual_seed(seed)
+            row = run_probes(lang, data, extractor, property, clf_type, majority_accs, chunk_size, epochs, control_seeds, control_jobs)
+            if row is not None and layer is not None:
+                row["Layer"] = layer
+            # Persist every cell as soon as it is done.
+            store.add(row, lang, property, clf_type, seed=seed, layer=layer, config=config, data=data_ids[layer])
+    store.close()
+    return layers
+
+def run_probes(lang, data, extractor, property, clf_type, majority_accs, chunk_size=None, epochs=5, control_seeds=1, control_jobs=None):
+    train_repr = extractor.train_repr
+    test_repr = extractor.test_repr
+    clf_probe = ClassifierProbe(data=data, train_repr=train_repr, test_repr=test_repr, clf_type=clf_type , property=property, extractor=extractor, chunk_size=chunk_size, epochs=epochs)
+    random_baseline = RandomBaseline(data=data, train_repr=train_repr, test_repr=test_repr, clf_type=clf_type , property=property, extractor=extractor, chunk_size=chunk_size, epochs=epochs)
+    # Seeds of the control tasks follow the global numpy random state.
+    control_probes = [
+        ControlTaskProbe(data=data, train_repr=train_repr, test_repr=test_repr, clf_type=clf_type , property=property, extractor=extractor, chunk_size=chunk_size, epochs=epochs, seed=control_seed)
+        for control_seed in np.random.randint(2**31 - 1, size=control_seeds)
+    ]
 
     # Training 
     try:
@@ -71,39 +163,127 @@ for lang in langs:
         ###
     except ValueError:
         print("Couldn't train.")
-        continue
+        return None
 
-    data_df["Language"].append(lang)
-    data_df["Classes"].append(",".join(classes))
-    data_df[f"{clf_type} Accuracy"].append(accs["Accuracy"])
-    data_df[f"{clf_type} Balanced Accuracy"].append(accs["Balanced Accuracy"])
+    row = {
+        "Language": lang,
+        "Classes": ",".join(sorted(classes)),
+        f"{clf_type} Accuracy": accs["Accuracy"],
+        f"{clf_type} Balanced Accuracy": accs["Balanced Accuracy"],
+    }
 
     clf_acc = accs["Accuracy"]
     ###############################
-    majority_baseline.train()
-    accs = majority_baseline.evaluate()
-    print(f"Majority Baseline: {accs}")
-    data_df["Majority Baseline Accuracy"].append(accs["Accuracy"])
-    data_df["Majority Baseline Balanced Accuracy"].append(accs["Balanced Accuracy"])
+    if property not in majority_accs:
+        majority_baseline = MajorityBaseline(data=data, property=property, extractor=extractor)
+        majority_baseline.train()
+        majority_accs[property] = majority_baseline.evaluate()
+        print(f"Majority Baseline: {majority_accs[property]}")
+    row["Majority Baseline Accuracy"] = majority_accs[property]["Accuracy"]
+    row["Majority Baseline Balanced Accuracy"] = majority_accs[property]["Balanced Accuracy"]
 
     ######################
     random_baseline.train()
     accs = random_baseline.evaluate()
     print(f"Random Baseline: {accs}")
-    data_df["Random Baseline Accuracy"].append(accs["Accuracy"])
-    data_df["Random Baseline Balanced Accuracy"].append(accs["Balanced Accuracy"])
+    row["Random Baseline Accuracy"] = accs["Accuracy"]
+    row["Random Baseline Balanced Accuracy"] = accs["Balanced Accuracy"]
 
     ##################
-    control_probe.train()
-    accs = control_probe.evaluate()
-    print(f"Control Task Probe: {accs}")
-    data_df[f"{clf_type} Sensitivity"].append(
-        clf_acc - accs["Accuracy"]
-    )
+    # The control tasks share the features of the split and are trained
+    # in parallel threads.
+    with ThreadPoolExecutor(max_workers=control_jobs or control_seeds) as pool:
+        control_accs = list(pool.map(train_and_evaluate, control_probes))
+    for accs in control_accs:
+        print(f"Control Task Probe: {accs}")
+    sensitivities = [clf_acc - accs["Accuracy"] for accs in control_accs]
+    row[f"{clf_type} Sensitivity"] = np.mean(sensitivities)
+    row[f"{clf_type} Sensitivity Std"] = np.std(sensitivities, ddof=1) if len(sensitivities) > 1 else np.nan
+    return row
 
-    smaller_sample = ""
+def train_and_evaluate(probe):
+    probe.train()
+    return probe.evaluate()
 
+def limit_threads(n_threads):
+    # Cap BLAS/OpenMP threads, so that workers don't oversubscribe the cores.
+    threadpool_limits(limits=n_threads)
+    torch.set_num_threads(n_threads)
 
-df = pd.DataFrame(data_df)
-df.to_csv(out, sep="\t")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Run probing experiments.")
+    parser.add_argument("--preprocessed_dir")
+    parser.add_argument("--out_path", help="Output TSV, may contain {property} and {clf_type} placeholders.")
+    parser.add_argument("--property", nargs="+", required=True)
+    parser.add_argument("--clf_type", nargs="+", required=True)
+    parser.add_argument("--layer", help="Layers to probe, e.g. 'all', '8', '0-12' or '0,4,8'.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of languages probed in parallel.")
+    parser.add_argument("--threads_per_worker", type=int, help="BLAS threads per worker, defaults to #cores / #workers.")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--store", help="SQLite file with results of finished runs, defaults to probe_results.sqlite next to --out_path.")
+    parser.add_argument("--chunk_size", type=int, help="Train incrementally on chunks of this many tokens read from the representations.")
+    parser.add_argument("--epochs", type=int, default=5, help="Passes over the training chunks, only used with --chunk_size.")
+    parser.add_argument("--control_seeds", type=int, default=1, help="Number of control tasks with different random mappings.")
+    parser.add_argument("--control_jobs", type=int, help="Control tasks trained in parallel, defaults to --control_seeds.")
+
+    args = parser.parse_args()
+
+    preprocessed_dir = args.preprocessed_dir
+    # Sorted, so that the results are in the same order for any number of workers.
+    langs = sorted(os.listdir(preprocessed_dir))
+    out = args.out_path
+    properties = args.property
+    clf_types = args.clf_type
+    if len(properties) * len(clf_types) > 1 and out.format(property="", clf_type="") == out:
+        parser.error("--out_path needs {property} and {clf_type} placeholders for several properties or classifiers.")
+    workers = args.workers
+    seed = args.seed
+    store_path = args.store
+    if store_path is None:
+        store_path = os.path.join(os.path.dirname(out), "probe_results.sqlite")
+    # Create the store before workers access it.
+    ResultStore(store_path).close()
+    threads_per_worker = args.threads_per_worker
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+
+    run = partial(
+        probe_language,
+        preprocessed_dir=preprocessed_dir,
+        properties=properties,
+        clf_types=clf_types,
+        store_path=store_path,
+        layer_spec=args.layer,
+        seed=seed,
+        chunk_size=args.chunk_size,
+        epochs=args.epochs,
+        control_seeds=args.control_seeds,
+        control_jobs=args.control_jobs
+    )
+    if workers > 1:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=limit_threads,
+            initargs=(threads_per_worker,)
+        ) as pool:
+            # map keeps the order of langs.
+            lang_layers = list(pool.map(run, langs))
+    else:
+        lang_layers = [run(lang) for lang in langs]
 
+    # One table per property and classifier, generated from the store.
+    config = run_config(args.chunk_size, args.epochs, args.control_seeds)
+    store = ResultStore(store_path)
+    for property in properties:
+        for clf_type in clf_types:
+            rows = []
+            for lang, layers in zip(langs, lang_layers):
+                for layer in layers:
+                    data_id = data_fingerprint(data_files(os.path.join(preprocessed_dir, lang), layer))
+                    if store.done(lang, property, clf_type, seed=seed, layer=layer, config=config, data=data_id):
+                        row = store.get(lang, property, clf_type, seed=seed, layer=layer, config=config, data=data_id)
+                        if row is not None:
+                            rows.append(row)
+            df = pd.DataFrame(rows, columns=result_columns(clf_type, args.layer))
+            df.to_csv(out.format(property=property, clf_type=clf_type), sep="\t")
+    store.close()
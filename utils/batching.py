@@ -0,0 +1,19 @@
+def length_batches(lengths, max_tokens=None, batch_size=None):
+    # Sort by length, so sentences of similar length share a batch
+    # and little compute is spent on padding.
+    order = sorted(range(len(lengths)), key=lambda idx: lengths[idx])
+    batches = []
+    batch = []
+    for idx in order:
+        # Lengths are ascending, so the current sentence is the longest
+        # in the batch and determines its padded size.
+        n_tokens = lengths[idx] * (len(batch) + 1)
+        too_many_tokens = max_tokens is not None and n_tokens > max_tokens
+        too_many_sents = batch_size is not None and len(batch) >= batch_size
+        if batch and (too_many_tokens or too_many_sents):
+            batches.append(batch)
+            batch = []
+        batch.append(idx)
+    if batch:
+        batches.append(batch)
+    return batches
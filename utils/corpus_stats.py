@@ -0,0 +1,93 @@
+# Label statistics of a Corpus, computed from its label index.
+import math
+
+import numpy as np
+
+
+def label_counts(corpus, properties=None):
+    # Count of every class of every property, upos and all UD features
+    # by default.
+    if properties is None:
+        properties = corpus.properties()
+    counts = dict()
+    for property in properties:
+        index = corpus.label_index(property)
+        counts[property] = (
+            index.classes,
+            np.bincount(index.codes, minlength=len(index.classes))
+        )
+    return counts
+
+def shannon_stats(counts):
+    # Number of labels, Shannon entropy and Shannon evenness index.
+    counts = counts[counts > 0]
+    n_labels = len(counts)
+    if n_labels == 0:
+        return n_labels, math.nan, math.nan
+    prop_labels = counts / counts.sum()
+    entropy = float(-np.sum(prop_labels * np.log(prop_labels)))
+    if n_labels <= 1:
+        return n_labels, entropy, math.nan
+    return n_labels, entropy, entropy / math.log(n_labels)
+
+def corpus_stats(corpus, properties=None):
+    n_tokens = corpus.n_tokens()
+    stats = dict()
+    for property, (classes, counts) in label_counts(corpus, properties).items():
+        n_labels, entropy, evenness = shannon_stats(counts)
+        stats[property] = {
+            "Shannon Evenness Index": evenness,
+            "#Labels": n_labels,
+            "Shannon Entropy": entropy,
+            "Coverage": counts.sum() / n_tokens if n_tokens > 0 else math.nan,
+        }
+    return stats
+
+def pos_feature_counts(corpus):
+    # Joint counts of upos and feature values, shape (#upos, #values).
+    upos_index = corpus.label_index("upos")
+    pos_codes = upos_index.codes
+    n_pos = len(upos_index.classes)
+    totals = np.bincount(pos_codes, minlength=n_pos)
+    joint_counts = dict()
+    for feat in corpus.properties():
+        if feat == "upos":
+            continue
+        index = corpus.label_index(feat)
+        n_values = len(index.classes)
+        joint = np.bincount(
+            pos_codes[index.positions] * n_values + index.codes,
+            minlength=n_pos * n_values
+        )
+        joint_counts[feat] = joint.reshape(n_pos, n_values)
+    return upos_index.classes, totals, joint_counts
+
+def features(corpus):
+    # Same result as Data.features: {upos: {feature: set of values}}
+    pos_classes, totals, joint_counts = pos_feature_counts(corpus)
+    feat_set = {pos_classes[pos]: dict() for pos in np.flatnonzero(totals)}
+    for feat, joint in joint_counts.items():
+        values = corpus.label_index(feat).classes
+        for pos in np.flatnonzero(joint.sum(axis=1)):
+            feat_set[pos_classes[pos]][feat] = {
+                values[val] for val in np.flatnonzero(joint[pos])
+            }
+    return feat_set
+
+def feature_coverage(corpus):
+    # Same result as Data.feature_coverage.
+    pos_classes, totals, joint_counts = pos_feature_counts(corpus)
+    present = np.flatnonzero(totals)
+    prop_pos = {pos_classes[pos]: totals[pos] / totals.sum() for pos in present}
+    prop_feats = {pos_classes[pos]: dict() for pos in present}
+    val_prop = {pos_classes[pos]: dict() for pos in present}
+    for feat, joint in joint_counts.items():
+        values = corpus.label_index(feat).classes
+        feat_totals = joint.sum(axis=1)
+        for pos in np.flatnonzero(feat_totals):
+            prop_feats[pos_classes[pos]][feat] = feat_totals[pos] / totals[pos]
+            val_prop[pos_classes[pos]][feat] = {
+                values[val]: joint[pos, val] / feat_totals[pos]
+                for val in np.flatnonzero(joint[pos])
+            }
+    return prop_pos, prop_feats, val_prop
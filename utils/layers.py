@@ -0,0 +1,25 @@
+def parse_layers(spec, n_layers=None):
+    # Accepts "all", a single layer "8", a range "0-12" or a list "0,4,8".
+    if spec is None:
+        return None
+    if spec == "all":
+        if n_layers is None:
+            raise ValueError("Number of layers must be known to select all layers.")
+        return list(range(n_layers))
+    layers = []
+    for part in spec.split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            layers.extend(range(int(start), int(end) + 1))
+        else:
+            layers.append(int(part))
+    if n_layers is not None:
+        invalid = [layer for layer in layers if not 0 <= layer < n_layers]
+        if invalid:
+            raise ValueError(f"Invalid layers {invalid}, the model has layers 0-{n_layers - 1}.")
+    return layers
+
+def repr_name(split, layer=None):
+    if layer is None:
+        return split
+    return f"{split}-layer{layer}"
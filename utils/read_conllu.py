@@ -1,7 +1,13 @@
+from collections.abc import Sequence
 from typing import List
+import json
 import os
 import random
 
+import numpy as np
+
+from . import corpus_stats
+
 class Data:
 
     def __init__(self, path: str=None, split_dict=None) -> None:
@@ -12,9 +18,14 @@ class Data:
         if split_dict is not None:
             self.splits = split_dict
         assert path is not None or split_dict is not None 
+        self._parsed = dict() # Parsed files of this instance
     
     def read_conllu(self, path: str, limit=None):
-        sents = []
+        return [Sentence(sent) for sent in self.iter_conllu(path, limit=limit)]
+
+    def iter_conllu(self, path: str, limit=None):
+        # Yields the word lines of one sentence at a time.
+        n_sents = 0
         with open(path, encoding="utf-8") as file:
             sent = []
             for line in file:
@@ -22,14 +33,40 @@ class Data:
                     if not line.startswith("#"):
                         sent.append(line.strip())
                 else: # Empty line means a new sentence will start.
-                    if limit is not None and len(sents) >= limit:
+                    if limit is not None and n_sents >= limit:
                         break
-                    sent_object = Sentence(sent)
-                    sents.append(sent_object)
+                    yield sent
+                    n_sents += 1
                     sent = []
-        return sents
-    
+
+    def reservoir_sample(self, paths, sample_size, seed=None, limit=None):
+        # Uniform sample of sentences from all files in a single pass,
+        # only sample_size sentences are kept in memory.
+        rng = random.Random(seed)
+        reservoir = []
+        n_seen = 0
+        for path in paths:
+            for sent in self.iter_conllu(path, limit=limit):
+                if n_seen < sample_size:
+                    reservoir.append(sent)
+                else:
+                    idx = rng.randrange(n_seen + 1)
+                    if idx < sample_size:
+                        reservoir[idx] = sent
+                n_seen += 1
+        if n_seen < sample_size:
+            raise ValueError("Sample larger than population")
+        return [Sentence(sent) for sent in reservoir]
+
+    def read_split(self, path: str, limit=None):
+        key = (path, limit)
+        if key not in self._parsed:
+            self._parsed[key] = self.read_conllu(path, limit=limit)
+        return self._parsed[key]
+
     def features(self, sents):
+        if isinstance(sents, Corpus):
+            return corpus_stats.features(sents)
         feat_set = dict()
         for sent in sents:
             for word in sent:
@@ -44,6 +81,8 @@ class Data:
         return feat_set
     
     def feature_coverage(self, sents):
+        if isinstance(sents, Corpus):
+            return corpus_stats.feature_coverage(sents)
         totals = dict()
         feat_total = dict()
         val_total = dict()
@@ -89,15 +128,22 @@ class Data:
         prop_pos = {pos: totals[pos] /  sum_pos for pos in totals}
         return prop_pos , prop_feats, val_prop
     
-    def train(self, verbose=False, sample_size=None, seed=None, limit=None, strict_sample=True):
-        random.seed(seed)
+    def train(self, verbose=False, sample_size=None, seed=None, limit=None, strict_sample=True, stream=False):
+        # Local generator, the global random state of callers stays untouched.
+        rng = random.Random(seed)
         train_data = []
+        if stream and isinstance(self.splits, list) and sample_size is not None and strict_sample:
+            # Sample while reading, without parsing the whole training data.
+            train_files = [split for split in self if "train" in split]
+            if verbose:
+                print("Sampling data from splits {}".format(train_files))
+            return self.reservoir_sample(train_files, sample_size, seed=seed, limit=limit)
         if isinstance(self.splits, list):
             for split in self:
                 if "train" in split:
                     if verbose:
                         print("Getting data from split {}".format(split))
-                    sents = self.read_conllu(split, limit=limit)
+                    sents = self.read_split(split, limit=limit)
                     train_data.extend(sents)
         if isinstance(self.splits, dict):
             train_data = self.splits.get("train", [])
@@ -105,7 +151,7 @@ class Data:
             return train_data
         else:
             if strict_sample is True:
-                return random.sample(train_data, k=sample_size)
+                return rng.sample(train_data, k=sample_size)
             else: 
                 return train_data
     
@@ -116,7 +162,7 @@ class Data:
                 if "test" in split:
                     if verbose:
                         print("Getting data from split {}".format(split))
-                    sents = self.read_conllu(split)
+                    sents = self.read_split(split)
                     test_data.extend(sents)
         if isinstance(self.splits, dict):
             test_data = self.splits.get("test", [])
@@ -129,7 +175,7 @@ class Data:
                 if "dev" in split:
                     if verbose:
                         print("Getting data from split {}".format(split))
-                    sents = self.read_conllu(split)
+                    sents = self.read_split(split)
                     val_data.extend(sents)
         if isinstance(self.splits, dict):
             val_data = self.splits.get("dev", [])
@@ -153,12 +199,55 @@ class Data:
             "dev": dev
         }
     
+    def to_npz(self, path):
+        # Binary columnar format: vocabularies shared by all splits and
+        # codes and sentence offsets per split.
+        corpora = list(self.splits.values())
+        if corpora and all(isinstance(corpus, Corpus) and corpus.vocabs is corpora[0].vocabs for corpus in corpora):
+            # Splits already share their vocabularies, e.g. from from_json.
+            splits = dict(self.splits)
+            vocabs = corpora[0].vocabs
+        else:
+            splits = dict()
+            vocabs = Corpus.new_vocabs()
+            for key in self.splits:
+                splits[key] = Corpus.from_lines([s.to_json() for s in self.splits[key]], vocabs=vocabs)
+        arrays = dict()
+        for col, vocab in enumerate(vocabs):
+            arrays[f"vocab{col}_bytes"], arrays[f"vocab{col}_offsets"] = vocab.to_arrays()
+        for key, corpus in splits.items():
+            arrays[f"{key}_codes"] = corpus.codes
+            arrays[f"{key}_offsets"] = corpus.offsets
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def from_npz(cls, path):
+        arrays = np.load(path)
+        vocabs = [
+            Vocab.from_arrays(arrays[f"vocab{col}_bytes"], arrays[f"vocab{col}_offsets"])
+            for col in range(Corpus.N_COLUMNS)
+        ]
+        split_dict = dict()
+        for name in arrays.files:
+            if name.endswith("_codes"):
+                key = name[:-len("_codes")]
+                split_dict[key] = Corpus(
+                    arrays[f"{key}_codes"],
+                    arrays[f"{key}_offsets"],
+                    vocabs
+                )
+        return cls(
+            split_dict=split_dict
+        )
+
     @classmethod
     def from_json(cls, json_dict):
         split_dict = dict()
+        # Splits share their vocabularies, so ids are comparable across splits.
+        vocabs = Corpus.new_vocabs()
         for key in json_dict:
             val = json_dict[key]
-            split_dict[key] = [Sentence(word_list) for word_list in val]
+            split_dict[key] = Corpus.from_lines(val, vocabs=vocabs)
         return cls(
             split_dict=split_dict
         )
@@ -229,15 +318,7 @@ class Word:
     def feats(self):
         if self._feats is not None:
             return self._feats
-        feats = self.word_feats[self.INDEX["feats"]]
-        feat_dict = dict()
-        if feats == "_":
-            return feat_dict
-        feats = feats.split("|")
-        for f in feats:
-            feat_key, feat_value = f.split("=")
-            feat_dict[feat_key] = feat_value
-        self._feats = feat_dict
+        self._feats = parse_feats(self.word_feats[self.INDEX["feats"]])
         return self._feats
 
     def __repr__(self) -> str:
@@ -252,6 +333,281 @@ class Word:
         string = sep.join(self.word_feats)
         return string
 
+def parse_feats(feats):
+    feat_dict = dict()
+    if feats == "_":
+        return feat_dict
+    feats = feats.split("|")
+    for f in feats:
+        feat_key, feat_value = f.split("=")
+        feat_dict[feat_key] = feat_value
+    return feat_dict
+
+
+class Vocab:
+
+    def __init__(self) -> None:
+        self.itos = []
+        self.stoi = dict()
+
+    def add(self, string):
+        idx = self.stoi.get(string)
+        if idx is None:
+            idx = len(self.itos)
+            self.stoi[string] = idx
+            self.itos.append(string)
+        return idx
+
+    @classmethod
+    def from_strings(cls, strings):
+        vocab = cls()
+        vocab.itos = list(strings)
+        vocab.stoi = {string: idx for idx, string in enumerate(vocab.itos)}
+        return vocab
+
+    def to_arrays(self):
+        # All strings as one UTF-8 buffer and the byte offsets into it.
+        encoded = [string.encode("utf-8") for string in self.itos]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(string) for string in encoded])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return data, offsets
+
+    @classmethod
+    def from_arrays(cls, data, offsets):
+        buffer = data.tobytes()
+        return cls.from_strings(
+            buffer[start:end].decode("utf-8")
+            for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())
+        )
+
+    def __getitem__(self, idx):
+        return self.itos[idx]
+
+    def __len__(self):
+        return len(self.itos)
+
+    def __repr__(self) -> str:
+        return "Vocab(#strings={})".format(len(self))
+
+
+class LabelIndex:
+    # Tokens that have a property and the codes of their labels. Codes
+    # index into classes, which are sorted and shared by all splits.
+
+    def __init__(self, positions, codes, classes) -> None:
+        self.positions = positions
+        self.codes = codes
+        self.classes = classes
+
+    def labels(self):
+        return np.array(self.classes, dtype=object)[self.codes]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __repr__(self) -> str:
+        return "LabelIndex(#tokens={}, #classes={})".format(len(self), len(self.classes))
+
+
+class Corpus(Sequence):
+    # Columnar storage of a split: every CoNLL-U column of every token is an
+    # id into an interned vocabulary, sentences are ranges of tokens given
+    # by offsets. Sentences and words are thin views on these arrays.
+
+    N_COLUMNS = 10
+
+    def __init__(self, codes, offsets, vocabs) -> None:
+        self.codes = codes # (#tokens, N_COLUMNS) int32
+        self.offsets = offsets # (#sents + 1,) int64
+        self.vocabs = vocabs # One Vocab per column
+        self._feats = dict() # Parsed feats per feats id
+        self._label_index = None
+
+    @classmethod
+    def new_vocabs(cls):
+        return [Vocab() for _ in range(cls.N_COLUMNS)]
+
+    @classmethod
+    def from_lines(cls, sents, vocabs=None):
+        # sents is a list of sentences, each a list of tab separated CoNLL-U lines.
+        if vocabs is None:
+            vocabs = cls.new_vocabs()
+        codes = []
+        lengths = []
+        for sent in sents:
+            lengths.append(len(sent))
+            for line in sent:
+                columns = line.split("\t")
+                if len(columns) != cls.N_COLUMNS:
+                    raise ValueError(f"Expected {cls.N_COLUMNS} columns: {line}")
+                codes.extend(vocab.add(col) for vocab, col in zip(vocabs, columns))
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        codes = np.array(codes, dtype=np.int32).reshape(-1, cls.N_COLUMNS)
+        return cls(codes, offsets, vocabs)
+
+    @classmethod
+    def from_sentences(cls, sents, vocabs=None):
+        if isinstance(sents, Corpus):
+            return sents
+        return cls.from_lines([sent.to_json() for sent in sents], vocabs=vocabs)
+
+    def column(self, name):
+        return self.codes[:, Word.INDEX[name]]
+
+    @property
+    def form_ids(self):
+        return self.column("form")
+
+    @property
+    def upos_ids(self):
+        return self.column("upos")
+
+    def feats(self, feats_id):
+        # Feats strings are parsed once per distinct string.
+        if feats_id not in self._feats:
+            feats = self.vocabs[Word.INDEX["feats"]][feats_id]
+            self._feats[feats_id] = parse_feats(feats)
+        return self._feats[feats_id]
+
+    def label_index(self, property):
+        if self._label_index is None:
+            self._label_index = self.build_label_index()
+        if property not in self._label_index:
+            return LabelIndex(
+                np.empty(0, dtype=np.int64),
+                np.empty(0, dtype=np.int32),
+                []
+            )
+        return self._label_index[property]
+
+    def build_label_index(self):
+        # Index of upos and every feature in one pass over the distinct
+        # upos and feats strings. Classes are taken from the vocabularies,
+        # which are shared by the splits, so codes agree across splits as
+        # long as all splits are encoded before the first index is built.
+        index = dict()
+        upos_vocab = self.vocabs[Word.INDEX["upos"]]
+        classes = sorted(upos_vocab.itos)
+        lookup = np.array([classes.index(upos) for upos in upos_vocab.itos], dtype=np.int32)
+        index["upos"] = LabelIndex(
+            np.arange(self.n_tokens()),
+            lookup[self.upos_ids],
+            classes
+        )
+
+        feats_vocab = self.vocabs[Word.INDEX["feats"]]
+        values = dict() # Feature -> {feats id: value}
+        for feats_id in range(len(feats_vocab)):
+            for feat, value in self.feats(feats_id).items():
+                values.setdefault(feat, dict())[feats_id] = value
+        feats_ids = self.column("feats")
+        for feat, feat_values in values.items():
+            classes = sorted(set(feat_values.values()))
+            lookup = np.full(len(feats_vocab), -1, dtype=np.int32)
+            for feats_id, value in feat_values.items():
+                lookup[feats_id] = classes.index(value)
+            codes = lookup[feats_ids]
+            positions = np.flatnonzero(codes >= 0)
+            index[feat] = LabelIndex(positions, codes[positions], classes)
+        return index
+
+    def properties(self):
+        if self._label_index is None:
+            self._label_index = self.build_label_index()
+        return [p for p, index in self._label_index.items() if len(index) > 0]
+
+    def n_tokens(self):
+        return self.codes.shape[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[idx] for idx in range(len(self))[index]]
+        return SentenceView(self, range(len(self))[index])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __repr__(self) -> str:
+        return "Corpus(#sents={}, #tokens={})".format(len(self), self.n_tokens())
+
+    def to_json(self):
+        return [sent.to_json() for sent in self]
+
+
+class SentenceView(Sentence):
+
+    def __init__(self, corpus, idx) -> None:
+        self.corpus = corpus
+        self.idx = idx
+        self.start = int(corpus.offsets[idx])
+        self.end = int(corpus.offsets[idx+1])
+
+    @property
+    def words(self):
+        return [WordView(self.corpus, pos) for pos in range(self.start, self.end)]
+
+    @property
+    def word_list(self):
+        return [w.to_string() for w in self]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.words[index]
+        return WordView(self.corpus, self.start + range(len(self))[index])
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __iter__(self):
+        return (WordView(self.corpus, pos) for pos in range(self.start, self.end))
+
+
+class WordView(Word):
+
+    def __init__(self, corpus, position) -> None:
+        self.corpus = corpus
+        self.position = position
+
+    def get(self, name):
+        col = Word.INDEX[name]
+        return self.corpus.vocabs[col][self.corpus.codes[self.position, col]]
+
+    @property
+    def word_feats(self):
+        codes = self.corpus.codes[self.position]
+        return [vocab[code] for vocab, code in zip(self.corpus.vocabs, codes)]
+
+    @property
+    def form(self):
+        return self.get("form")
+
+    @property
+    def id(self):
+        return self.get("id")
+
+    @property
+    def lemma(self):
+        return self.get("lemma")
+
+    @property
+    def upos(self):
+        return self.get("upos")
+
+    @property
+    def feats(self):
+        return self.corpus.feats(self.corpus.codes[self.position, Word.INDEX["feats"]])
+
+def load_preprocessed(path):
+    # Load a preprocessed language directory, preferring the binary format.
+    npz_path = os.path.join(path, "preprocessed.npz")
+    if os.path.exists(npz_path):
+        return Data.from_npz(npz_path)
+    with open(os.path.join(path, "preprocessed.json"), encoding="utf-8") as file:
+        split_dict = json.load(file)
+    return Data.from_json(split_dict)
+
 if __name__ == "__main__":
     path = "data/Tamil"
     langs = os.listdir("data")
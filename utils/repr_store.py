@@ -0,0 +1,94 @@
+import argparse
+import os
+
+import numpy as np
+
+
+# Word representations of all sentences of a split in one contiguous
+# float32 array, memory-mapped from disk. Sentence idx covers the rows
+# offsets[idx]:offsets[idx+1].
+class ReprStore:
+
+    def __init__(self, array, offsets) -> None:
+        self.array = array
+        self.offsets = offsets
+
+    def __getitem__(self, key):
+        idx = int(key) # Same keys as the npz files: str(idx)
+        return self.array[self.offsets[idx]:self.offsets[idx+1]]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __repr__(self) -> str:
+        return "ReprStore(#sents={}, shape={})".format(len(self), self.array.shape)
+
+    @staticmethod
+    def paths(path, name):
+        return (
+            os.path.join(path, name + ".npy"),
+            os.path.join(path, name + "-offsets.npy")
+        )
+
+    @classmethod
+    def exists(cls, path, name):
+        return all(os.path.exists(p) for p in cls.paths(path, name))
+
+    @classmethod
+    def load(cls, path, name):
+        array_path, offsets_path = cls.paths(path, name)
+        return cls(
+            array=np.load(array_path, mmap_mode="r"),
+            offsets=np.load(offsets_path)
+        )
+
+    @classmethod
+    def save(cls, path, name, reprs):
+        array_path, offsets_path = cls.paths(path, name)
+        lengths = [sent.shape[0] for sent in reprs]
+        offsets = np.zeros(len(reprs) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        hidden_size = reprs[0].shape[-1] if len(reprs) > 0 else 0
+        # Write sentence by sentence to avoid a second copy in memory.
+        array = np.lib.format.open_memmap(
+            array_path,
+            mode="w+",
+            dtype=np.float32,
+            shape=(int(offsets[-1]), hidden_size)
+        )
+        for idx, sent in enumerate(reprs):
+            array[offsets[idx]:offsets[idx+1]] = sent
+        array.flush()
+        np.save(offsets_path, offsets)
+        return cls.load(path, name)
+
+
+def repr_exists(path, name):
+    return ReprStore.exists(path, name) or os.path.exists(os.path.join(path, name + ".npz"))
+
+def load_repr(path, name):
+    # Prefer the memory-mapped store and fall back to npz files.
+    if ReprStore.exists(path, name):
+        return ReprStore.load(path, name)
+    return np.load(os.path.join(path, name + ".npz"))
+
+def npz_to_store(path, name):
+    npz = np.load(os.path.join(path, name + ".npz"))
+    reprs = [npz[str(idx)] for idx in range(len(npz))]
+    return ReprStore.save(path, name, reprs)
+
+
+if __name__ == "__main__":
+    # Convert npz representations of preprocessed languages.
+    parser = argparse.ArgumentParser("Convert npz representations to memory-mapped stores.")
+    parser.add_argument("--data_dir")
+    args = parser.parse_args()
+
+    for lang in os.listdir(args.data_dir):
+        path = os.path.join(args.data_dir, lang)
+        for f in os.listdir(path):
+            if f.endswith(".npz") and f != "preprocessed.npz":
+                name = f[:-len(".npz")]
+                if not ReprStore.exists(path, name):
+                    print(f"Converting {os.path.join(path, f)}")
+                    npz_to_store(path, name)
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+
+# Results of single experiment cells, persisted as soon as they are done,
+# so that interrupted runs can be resumed.
+class ResultStore:
+
+    KEY = ("language", "property", "clf_type", "seed", "layer", "config", "data")
+
+    def __init__(self, path) -> None:
+        self.path = path
+        # Several worker processes may write at the same time.
+        self.conn = sqlite3.connect(path, timeout=600)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "language TEXT, property TEXT, clf_type TEXT, seed TEXT, layer TEXT, config TEXT, "
+            "data TEXT, row TEXT, PRIMARY KEY (language, property, clf_type, seed, layer, config, data))"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def key(language, property, clf_type, seed=None, layer=None, config=None, data=None):
+        # seed, layer, config and data are optional, None is stored as an
+        # empty string. config holds the non-default settings of a run,
+        # e.g. {"control_seeds": 5}, and data the fingerprint of the input
+        # files (see data_fingerprint).
+        return (
+            language,
+            property,
+            clf_type,
+            "" if seed is None else str(seed),
+            "" if layer is None else str(layer),
+            json.dumps(config, sort_keys=True) if config else "",
+            "" if data is None else data
+        )
+
+    def add(self, row, language, property, clf_type, seed=None, layer=None, config=None, data=None):
+        # row is None for cells that could not be trained.
+        self.conn.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            self.key(language, property, clf_type, seed, layer, config, data) + (json.dumps(row),)
+        )
+        self.conn.commit()
+
+    def get(self, language, property, clf_type, seed=None, layer=None, config=None, data=None):
+        cursor = self.conn.execute(
+            "SELECT row FROM results WHERE language=? AND property=? AND clf_type=? AND seed=? AND layer=? AND config=? AND data=?",
+            self.key(language, property, clf_type, seed, layer, config, data)
+        )
+        result = cursor.fetchone()
+        if result is None:
+            raise KeyError(self.key(language, property, clf_type, seed, layer, config, data))
+        return json.loads(result[0])
+
+    def done(self, language, property, clf_type, seed=None, layer=None, config=None, data=None):
+        try:
+            self.get(language, property, clf_type, seed, layer, config, data)
+        except KeyError:
+            return False
+        return True
+
+    def close(self):
+        self.conn.close()
+
+    def __repr__(self) -> str:
+        return "ResultStore(path={})".format(self.path)
+
+
+def data_fingerprint(paths):
+    # Identifies the input data of results by the paths, sizes and
+    # modification times of its files, so that results of other or
+    # regenerated data are not reused.
+    sha = hashlib.sha1()
+    for path in sorted(os.path.abspath(path) for path in paths):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            sha.update(f"{path}\t{stat.st_size}\t{stat.st_mtime_ns}\n".encode("utf-8"))
+    return sha.hexdigest()
@@ -1,28 +1,32 @@
 #  Calculate vocabulary overlap.
 
-from probe.probe import get_original_word_representations, convert_to_ids
-from utils.read_conllu import Data
+from probe.token_cache import load_token_ids
+from utils.read_conllu import load_preprocessed
 
 import argparse
-import json
+import numpy as np
 import pandas as pd
 import os
-from transformers import BertTokenizer, BertModel
-from tqdm import tqdm
+from scipy import sparse
+from transformers import BertTokenizerFast
 
-def load_json(path):
-    with open(path, encoding="utf-8") as file:
-        split_dict = json.load(file)
-    return Data.from_json(split_dict)
+def get_vocab_ids(token_ids):
+    return np.unique(token_ids.ids)
 
-def get_vocab_ids(sent_list, tokenizer):
-    vocab_ids = set()
-    for sent in sent_list:
-        words = [w.form for w in sent]
-        _, ids = convert_to_ids(words, tokenizer=tokenizer)
-        ids = ids.tolist()
-        vocab_ids = vocab_ids.union(*ids)
-    return vocab_ids
+def get_overlap(vocab_ids):
+    # Binary language x vocabulary incidence matrix. Its product with its
+    # transpose counts the ids that are shared by each pair of languages.
+    if len(vocab_ids) == 0:
+        return np.empty((0, 0))
+    rows = np.repeat(np.arange(len(vocab_ids)), [len(ids) for ids in vocab_ids])
+    cols = np.concatenate(vocab_ids)
+    incidence = sparse.csr_matrix(
+        (np.ones(len(cols), dtype=np.int64), (rows, cols)),
+        shape=(len(vocab_ids), int(cols.max()) + 1)
+    )
+    common = (incidence @ incidence.T).toarray()
+    # Proportion of the vocabulary of the row language.
+    return common / np.asarray(incidence.sum(axis=1))
 
 if __name__ == "__main__":
     # Set up argument parser.
@@ -30,6 +34,7 @@ if __name__ == "__main__":
     parser.add_argument("--data_dir")
     parser.add_argument("--pretrained")
     parser.add_argument("--out_dir")
+    parser.add_argument("--cache_dir", help="Directory of cached subword ids, defaults to token_cache in each language directory.")
     args = parser.parse_args()
     
     out_dir = args.out_dir #"results/vocab_overlap.tsv"
@@ -37,7 +42,7 @@ if __name__ == "__main__":
     pretrained = args.pretrained#"google-bert/bert-base-multilingual-cased"
 
     # Load Tokenizer
-    tokenizer = BertTokenizer.from_pretrained(pretrained)
+    tokenizer = BertTokenizerFast.from_pretrained(pretrained)
 
     langs = os.listdir(data_dir)
     langs_ids = dict()
@@ -46,27 +51,20 @@ if __name__ == "__main__":
     for language in langs:
         print("Processing language {}".format(language))
         path = os.path.join(data_dir, language)
-        data = load_json(os.path.join(path, "preprocessed.json"))
+        data = load_preprocessed(path)
         train_sents = data.train()
-        ids = get_vocab_ids(train_sents, tokenizer=tokenizer) # Get set of vocabulary ids.
+        if args.cache_dir is not None:
+            cache_dir = os.path.join(args.cache_dir, language)
+        else:
+            cache_dir = os.path.join(path, "token_cache")
+        token_ids = load_token_ids(train_sents, tokenizer, cache_dir=cache_dir)
+        ids = get_vocab_ids(token_ids) # Get set of vocabulary ids.
         langs_ids[language] = ids
     
-    overlap = dict()
     # Filter for languages with training material.
     train_langs = [lang for lang in langs_ids if len(langs_ids[lang]) != 0]
-
-    for lang_i in tqdm(train_langs):
-        overlap[lang_i] = []
-        ids_i = langs_ids[lang_i]
-        for lang_j in train_langs:
-            ids_j = langs_ids[lang_j]
-            intersect = ids_i.intersection(ids_j) # Compute set of ids that are present in both languages.
-            prop_common = len(intersect) / len(ids_i) # Compute proportion in lang_i
-            overlap[lang_i].append(prop_common)
+    overlap = get_overlap([langs_ids[lang] for lang in train_langs])
 
     # Save tsv file.
-    df = pd.DataFrame.from_dict(overlap, orient="index", columns=train_langs)
+    df = pd.DataFrame(overlap, index=train_langs, columns=train_langs)
     df.to_csv(out_dir, sep="\t")
-
-    
-